@@ -1,64 +1,252 @@
 import asyncio
-import json
+import functools
 import logging
 import os
+import shutil
+from collections import OrderedDict
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
 from dataclasses import dataclass, field
 
+import orjson
+
 from config import Config
 
 logger = logging.getLogger(__name__)
 
-# Track which session IDs have been created (first message) vs need resuming
-_created_sessions: set[str] = set()
+# Size of each read from the claude stdout pipe
+_READ_CHUNK = 64 * 1024
+
+# StreamReader buffer limit; large tool-output events arrive without the
+# transport pausing and resuming the pipe several times per line
+_STREAM_LIMIT = 1 << 20
+
+# Prompts up to this size fit in the pipe buffer, so there's nothing to drain
+_DRAIN_THRESHOLD = 32 * 1024
+
+# Give up if claude goes this long without producing a line
+_LINE_TIMEOUT = 300
+
+# Flags shared by every claude invocation
+_BASE_ARGS = ("-p", "--output-format", "stream-json", "--verbose")
+
+# Strip CLAUDECODE env var so the child process doesn't think
+# it's nested inside another Claude Code session.
+_CHILD_ENV = os.environ.copy()
+_CHILD_ENV.pop("CLAUDECODE", None)
+
+# claude children run at lower priority, and when there are enough CPUs they
+# stay off the first two so the bot's event loop keeps a core to itself.
+# Applied through nice/taskset in front of the command so every thread the
+# child starts inherits them.
+_CHILD_NICE = 5
+_RESERVED_CPUS = 2
+
+
+def _child_cpus() -> set[int] | None:
+    if not hasattr(os, "sched_getaffinity"):
+        return None
+    cpus = sorted(os.sched_getaffinity(0))
+    if len(cpus) < 2 * _RESERVED_CPUS:
+        return None
+    return set(cpus[_RESERVED_CPUS:])
+
+
+_CHILD_CPUS = _child_cpus()
+
+
+def _sched_prefix() -> tuple[str, ...]:
+    prefix: list[str] = []
+    nice = shutil.which("nice")
+    if nice:
+        prefix.extend([nice, "-n", str(_CHILD_NICE)])
+    taskset = shutil.which("taskset")
+    if taskset and _CHILD_CPUS:
+        prefix.extend([taskset, "-c", ",".join(map(str, sorted(_CHILD_CPUS)))])
+    return tuple(prefix)
+
 
+_SCHED_PREFIX = _sched_prefix()
 
-@dataclass
+# A line can only matter to _collect_event if it contains one of these;
+# anything else (system events, successful tool results) is skipped unparsed.
+_INTERESTING = (b'"assistant"', b'"content_block_delta"', b'"result"', b'"is_error"')
+
+# Track which session IDs have been created (first message) vs need resuming.
+# Bounded so a long-running bot doesn't keep every session it has ever seen.
+_MAX_CREATED_SESSIONS = 10_000
+_created_sessions: OrderedDict[str, None] = OrderedDict()
+
+# Per-session lock and its number of users (holder plus waiters)
+_session_locks: dict[str, tuple[asyncio.Lock, int]] = {}
+
+
+def mark_session_created(session_id: str) -> None:
+    """Record that claude already has this session, so later runs resume it."""
+    _created_sessions[session_id] = None
+    _created_sessions.move_to_end(session_id)
+    if len(_created_sessions) > _MAX_CREATED_SESSIONS:
+        _created_sessions.popitem(last=False)
+
+
+def unmark_session_created(session_id: str) -> None:
+    """Forget a session, so the next run starts it with --session-id."""
+    _created_sessions.pop(session_id, None)
+
+
+def is_session_created(session_id: str) -> bool:
+    return session_id in _created_sessions
+
+
+@dataclass(slots=True, frozen=True)
 class PermissionDenial:
     tool_name: str
     tool_input: dict
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class ToolError:
     message: str
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class ExecuteResult:
     text: str
     permission_denials: list[PermissionDenial] = field(default_factory=list)
     tool_errors: list[ToolError] = field(default_factory=list)
 
 
+@functools.lru_cache(maxsize=16)
+def _config_args(
+    claude_bin: str | None,
+    model: str,
+    max_budget: str | None,
+    allowed_tools: str | None,
+) -> tuple[tuple[str, ...], tuple[str, ...]]:
+    """The (prefix, suffix) of the command line that only depend on config.
+
+    Keyed on the values rather than the Config object, since /model and
+    /budget change them at runtime.
+    """
+    prefix = [claude_bin or "claude", *_BASE_ARGS, "--model", model]
+    if max_budget:
+        prefix.extend(["--max-budget-usd", max_budget])
+
+    suffix = ("--allowedTools", allowed_tools) if allowed_tools else ()
+    return tuple(prefix), suffix
+
+
 def _build_cmd(
     session_id: str,
     config: Config,
     permission_mode: str | None = None,
     is_resume: bool = False,
 ) -> list[str]:
-    cmd = [
-        "claude",
-        "-p",
-        "--output-format", "stream-json",
-        "--verbose",
-        "--model", config.claude_model,
-    ]
-
-    if is_resume or session_id in _created_sessions:
-        cmd.extend(["--resume", session_id])
-    else:
-        cmd.extend(["--session-id", session_id])
+    prefix, suffix = _config_args(
+        config.claude_bin,
+        config.claude_model,
+        config.claude_max_budget,
+        config.claude_allowed_tools,
+    )
+    flag = "--resume" if is_resume or session_id in _created_sessions else "--session-id"
+    # Only wrap a claude that resolves, so a missing one still raises
+    # FileNotFoundError instead of becoming nice's exit status 127
+    sched = _SCHED_PREFIX if _SCHED_PREFIX and shutil.which(prefix[0]) else ()
 
     if permission_mode:
-        cmd.extend(["--permission-mode", permission_mode])
+        return [*sched, *prefix, flag, session_id, "--permission-mode", permission_mode, *suffix]
+    return [*sched, *prefix, flag, session_id, *suffix]
+
+
+async def _read_lines(stream: asyncio.StreamReader) -> AsyncIterator[bytes]:
+    """Yield newline-delimited lines from a stream, reading it in large chunks.
+
+    Splitting happens on our side, so a chatty producer costs one await per
+    chunk rather than one per line.
+    """
+    pending = bytearray()
+    while True:
+        chunk = await stream.read(_READ_CHUNK)
+        if not chunk:
+            break
+        pending += chunk
+        if b"\n" not in chunk:
+            continue
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            # Blank keepalive lines never reach the caller
+            if line and not line.isspace():
+                yield line
+
+    if pending and not pending.isspace():
+        yield pending
+
+
+def _collect_event(
+    data: dict,
+    text_buf: bytearray,
+    permission_denials: list[PermissionDenial],
+    tool_errors: list[ToolError],
+) -> None:
+    """Fold one stream-json event into the response being collected."""
+    match data:
+        case {"type": "assistant", "message": {"content": [*blocks]}}:
+            for block in blocks:
+                match block:
+                    case {"type": "text", "text": str(text)} if text:
+                        text_buf += text.encode()
+
+        case {"type": "content_block_delta", "delta": {"type": "text_delta", "text": str(text)}} if text:
+            text_buf += text.encode()
+
+        case {"type": "user", "message": {"content": [*blocks]}}:
+            # Capture tool errors from tool_result messages
+            for block in blocks:
+                match block:
+                    case {"is_error": is_error, "content": err_content} if is_error and err_content:
+                        tool_errors.append(ToolError(message=err_content))
+
+        case {"type": "result"}:
+            result_text = data.get("result")
+            if result_text and not text_buf:
+                text_buf += result_text.encode()
+
+            # Capture permission denials
+            for denial in data.get("permission_denials", []):
+                permission_denials.append(
+                    PermissionDenial(
+                        tool_name=denial.get("tool_name", "unknown"),
+                        tool_input=denial.get("tool_input", {}),
+                    )
+                )
+
 
-    if config.claude_max_budget:
-        cmd.extend(["--max-budget-usd", config.claude_max_budget])
+@functools.cache
+def _run_slots(limit: int) -> asyncio.Semaphore:
+    """The semaphore capping how many claude processes run at once."""
+    return asyncio.Semaphore(limit)
 
-    if config.claude_allowed_tools:
-        cmd.extend(["--allowedTools", config.claude_allowed_tools])
 
-    return cmd
+@asynccontextmanager
+async def _session_turn(session_id: str):
+    """Hold the session's lock for one claude run.
+
+    Locks are refcounted so the entry disappears once nobody is using or
+    waiting on that session.
+    """
+    lock, users = _session_locks.get(session_id, (None, 0))
+    if lock is None:
+        lock = asyncio.Lock()
+    _session_locks[session_id] = (lock, users + 1)
+    try:
+        async with lock:
+            yield
+    finally:
+        lock, users = _session_locks[session_id]
+        if users == 1:
+            del _session_locks[session_id]
+        else:
+            _session_locks[session_id] = (lock, users - 1)
 
 
 async def execute(
@@ -71,16 +259,31 @@ async def execute(
 ) -> ExecuteResult:
     """Run claude CLI and collect the full response.
 
+    Calls for the same session are queued: only one claude process can use a
+    session at a time, and a queued call resumes what the previous one created.
+    At most config.claude_max_concurrency runs proceed at once; a call only
+    takes a slot once it holds its session's lock.
+
     Returns an ExecuteResult with the text and any permission denials.
     """
+    async with _session_turn(session_id), _run_slots(config.claude_max_concurrency):
+        return await _execute(
+            prompt, session_id, config, working_directory, permission_mode, is_resume
+        )
+
+
+async def _execute(
+    prompt: str,
+    session_id: str,
+    config: Config,
+    working_directory: str,
+    permission_mode: str | None,
+    is_resume: bool,
+) -> ExecuteResult:
     cmd = _build_cmd(session_id, config, permission_mode, is_resume)
 
     logger.info("Running: %s (cwd=%s)", " ".join(cmd), working_directory)
 
-    # Strip CLAUDECODE env var so the child process doesn't think
-    # it's nested inside another Claude Code session.
-    env = {k: v for k, v in os.environ.items() if k != "CLAUDECODE"}
-
     try:
         proc = await asyncio.create_subprocess_exec(
             *cmd,
@@ -88,93 +291,60 @@ async def execute(
             stdout=asyncio.subprocess.PIPE,
             stderr=asyncio.subprocess.PIPE,
             cwd=working_directory,
-            env=env,
+            env=_CHILD_ENV,
+            limit=_STREAM_LIMIT,
         )
     except FileNotFoundError:
         return ExecuteResult(
             text="Error: `claude` CLI not found. Make sure Claude Code is installed and on your PATH."
         )
 
+    # Drain stderr alongside stdout so a chatty child can't fill the pipe and block
+    stderr_task = asyncio.create_task(proc.stderr.read())
+
     # Send the prompt on stdin and close it
-    proc.stdin.write(prompt.encode())
-    await proc.stdin.drain()
+    data = prompt.encode()
+    proc.stdin.write(data)
+    if len(data) > _DRAIN_THRESHOLD:
+        await proc.stdin.drain()
     proc.stdin.close()
 
     # Read stdout line by line (stream-json produces one JSON object per line)
-    collected_text: list[str] = []
+    text_buf = bytearray()
     permission_denials: list[PermissionDenial] = []
     tool_errors: list[ToolError] = []
 
+    loop = asyncio.get_running_loop()
     try:
-        while True:
-            line = await asyncio.wait_for(
-                proc.stdout.readline(), timeout=300  # 5 min timeout per line
-            )
-            if not line:
-                break
-
-            line_str = line.decode().strip()
-            if not line_str:
-                continue
-
-            try:
-                data = json.loads(line_str)
-            except json.JSONDecodeError:
-                logger.debug("Non-JSON line from claude: %s", line_str)
-                continue
-
-            msg_type = data.get("type")
-
-            if msg_type == "assistant":
-                for block in data.get("message", {}).get("content", []):
-                    if block.get("type") == "text":
-                        text = block.get("text", "")
-                        if text:
-                            collected_text.append(text)
-
-            elif msg_type == "content_block_delta":
-                delta = data.get("delta", {})
-                if delta.get("type") == "text_delta":
-                    text = delta.get("text", "")
-                    if text:
-                        collected_text.append(text)
-
-            elif msg_type == "user":
-                # Capture tool errors from tool_result messages
-                msg = data.get("message", {})
-                content = msg.get("content", [])
-                if isinstance(content, list):
-                    for block in content:
-                        if isinstance(block, dict) and block.get("is_error"):
-                            err_content = block.get("content", "")
-                            if err_content:
-                                tool_errors.append(ToolError(message=err_content))
-
-            elif msg_type == "result":
-                result_text = data.get("result", "")
-                if result_text and not collected_text:
-                    collected_text.append(result_text)
-
-                # Capture permission denials
-                for denial in data.get("permission_denials", []):
-                    permission_denials.append(
-                        PermissionDenial(
-                            tool_name=denial.get("tool_name", "unknown"),
-                            tool_input=denial.get("tool_input", {}),
-                        )
-                    )
+        # One deadline for the whole read, pushed back after every line
+        async with asyncio.timeout(_LINE_TIMEOUT) as deadline:
+            async for line in _read_lines(proc.stdout):
+                deadline.reschedule(loop.time() + _LINE_TIMEOUT)
+
+                # Lines go to orjson exactly as read; it ignores surrounding whitespace
+                if not any(tok in line for tok in _INTERESTING):
+                    continue
+
+                try:
+                    data = orjson.loads(line)
+                except orjson.JSONDecodeError:
+                    logger.debug("Non-JSON line from claude: %r", line)
+                    continue
+
+                _collect_event(data, text_buf, permission_denials, tool_errors)
 
-    except asyncio.TimeoutError:
+    except TimeoutError:
         proc.kill()
+        stderr_task.cancel()
         return ExecuteResult(text="[Timed out waiting for Claude response]")
 
     await proc.wait()
+    stderr_bytes = await stderr_task
 
-    if proc.returncode == 0 or collected_text:
-        _created_sessions.add(session_id)
+    if proc.returncode == 0 or text_buf:
+        mark_session_created(session_id)
 
-    if proc.returncode and proc.returncode != 0 and not collected_text:
-        stderr_bytes = await proc.stderr.read()
+    if proc.returncode and proc.returncode != 0 and not text_buf:
         stderr_text = stderr_bytes.decode().strip()
         if stderr_text:
             logger.error("claude stderr: %s", stderr_text)
@@ -184,7 +354,7 @@ async def execute(
         return ExecuteResult(text=error_msg)
 
     return ExecuteResult(
-        text="".join(collected_text).strip(),
+        text=text_buf.decode().strip(),
         permission_denials=permission_denials,
         tool_errors=tool_errors,
     )
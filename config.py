@@ -1,4 +1,7 @@
+import functools
 import os
+import shutil
+from dataclasses import dataclass
 from pathlib import Path
 
 from dotenv import load_dotenv
@@ -6,24 +9,48 @@ from dotenv import load_dotenv
 load_dotenv()
 
 
+@dataclass(slots=True)
 class Config:
-    def __init__(self):
-        self.telegram_bot_token: str = os.getenv("TELEGRAM_BOT_TOKEN", "")
+    # Not frozen: /model and /budget change these at runtime.
+    telegram_bot_token: str
+    allowed_user_ids: frozenset[int]
+    claude_model: str
+    claude_max_budget: str | None
+    claude_allowed_tools: str | None
+    claude_bin: str | None
+    claude_max_concurrency: int
+    claude_projects_dir: str
+    default_working_directory: str
+    state_file: str
+    webhook_url: str | None
+    webhook_port: int
+
+    @classmethod
+    def from_env(cls) -> "Config":
         allowed = os.getenv("ALLOWED_USER_IDS", "")
-        self.allowed_user_ids: set[int] = (
-            {int(uid.strip()) for uid in allowed.split(",") if uid.strip()}
-            if allowed
-            else set()
-        )
-        self.claude_model: str = os.getenv("CLAUDE_MODEL", "sonnet")
-        self.claude_max_budget: str | None = os.getenv("CLAUDE_MAX_BUDGET")
-        self.claude_allowed_tools: str | None = os.getenv("CLAUDE_ALLOWED_TOOLS")
-        self.claude_projects_dir: str = os.getenv(
-            "CLAUDE_PROJECTS_DIR",
-            str(Path.home() / ".claude" / "projects"),
-        )
-        self.default_working_directory: str = os.getenv(
-            "DEFAULT_WORKING_DIRECTORY", str(Path.home())
+        return cls(
+            telegram_bot_token=os.getenv("TELEGRAM_BOT_TOKEN", ""),
+            allowed_user_ids=frozenset(
+                int(uid.strip()) for uid in allowed.split(",") if uid.strip()
+            ),
+            claude_model=os.getenv("CLAUDE_MODEL", "sonnet"),
+            claude_max_budget=os.getenv("CLAUDE_MAX_BUDGET"),
+            claude_allowed_tools=os.getenv("CLAUDE_ALLOWED_TOOLS"),
+            # Resolved once so each spawn execs directly instead of searching PATH
+            claude_bin=shutil.which("claude"),
+            claude_max_concurrency=int(os.getenv("CLAUDE_MAX_CONCURRENCY", "4")),
+            claude_projects_dir=os.getenv(
+                "CLAUDE_PROJECTS_DIR",
+                str(Path.home() / ".claude" / "projects"),
+            ),
+            default_working_directory=os.getenv(
+                "DEFAULT_WORKING_DIRECTORY", str(Path.home())
+            ),
+            state_file=os.path.expanduser(
+                os.getenv("STATE_FILE", "~/.teleg-ode/state.json")
+            ),
+            webhook_url=os.getenv("WEBHOOK_URL"),
+            webhook_port=int(os.getenv("WEBHOOK_PORT", "8443")),
         )
 
     def validate(self) -> list[str]:
@@ -35,3 +62,9 @@ class Config:
                 f"Claude projects directory not found: {self.claude_projects_dir}"
             )
         return errors
+
+
+@functools.cache
+def get_config() -> Config:
+    """Parse the environment once and return the shared Config."""
+    return Config.from_env()
@@ -1,9 +1,14 @@
+import asyncio
 import logging
-import shutil
 import sys
 
-from config import Config
-from platforms.telegram_bot import create_app
+from config import get_config
+from platforms.telegram_bot import run_bot
+
+try:
+    import uvloop
+except ImportError:  # not available on Windows
+    uvloop = None
 
 logging.basicConfig(
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
@@ -13,7 +18,7 @@ logger = logging.getLogger(__name__)
 
 
 def main() -> None:
-    config = Config()
+    config = get_config()
 
     errors = config.validate()
     if errors:
@@ -21,7 +26,7 @@ def main() -> None:
             logger.error(e)
         sys.exit(1)
 
-    if not shutil.which("claude"):
+    if not config.claude_bin:
         logger.error(
             "claude CLI not found on PATH. "
             "Install Claude Code first: https://docs.anthropic.com/en/docs/claude-code"
@@ -32,13 +37,19 @@ def main() -> None:
     logger.info("Projects dir: %s", config.claude_projects_dir)
     logger.info("Default working dir: %s", config.default_working_directory)
     logger.info("Model: %s", config.claude_model)
+    logger.info("claude CLI: %s", config.claude_bin)
     if config.allowed_user_ids:
-        logger.info("Restricted to user IDs: %s", config.allowed_user_ids)
+        logger.info(
+            "Restricted to user IDs: %s", ", ".join(map(str, sorted(config.allowed_user_ids)))
+        )
     else:
         logger.info("No user restrictions (anyone can use the bot)")
 
-    app = create_app(config)
-    app.run_polling(drop_pending_updates=True)
+    if uvloop is not None:
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+        logger.info("Using uvloop event loop")
+
+    run_bot(config)
 
 
 if __name__ == "__main__":
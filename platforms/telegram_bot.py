@@ -1,12 +1,22 @@
 import asyncio
+import functools
+import itertools
 import json
 import logging
 import os
+import re
+import secrets
 import uuid
+from contextlib import asynccontextmanager, suppress
 from dataclasses import dataclass, field
+from datetime import timedelta
 
+import orjson
+from cachetools import Cache, LRUCache, TTLCache
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
 from telegram.constants import ChatAction, ParseMode
+from telegram.error import BadRequest, RetryAfter, TelegramError
+from telegram.request import HTTPXRequest
 from telegram.ext import (
     Application,
     CallbackQueryHandler,
@@ -19,7 +29,14 @@ from telegram.ext import (
 import claude_executor
 from claude_executor import PermissionDenial
 from config import Config
-from sessions import find_session, list_projects, list_sessions
+from sessions import (
+    SessionInfo,
+    build_project_index,
+    find_session,
+    list_projects,
+    list_sessions,
+    short_path,
+)
 from utils import escape_markdown_v2, split_message
 
 logger = logging.getLogger(__name__)
@@ -33,30 +50,148 @@ class ChatState:
     session_id: str
     project_dir_name: str | None = None
     working_directory: str | None = None
+    # Sessions last shown to this chat, checked before disk on /resume <prefix>
+    recent_sessions: list[SessionInfo] = field(default_factory=list)
 
 
-_chat_states: dict[int, ChatState] = {}
+# All three are bounded so a long-running bot doesn't grow without limit.
+# Button payloads are stale after ten minutes; a permission prompt stays
+# answerable for an hour, since the user may only see it later.
+_chat_states: LRUCache[int, ChatState] = LRUCache(maxsize=10_000)
 
 # Pending permission requests: callback_id -> dict
-_pending_permissions: dict[str, dict] = {}
+_pending_permissions: TTLCache[str, dict] = TTLCache(maxsize=1024, ttl=3600)
 
 # Temporary storage for callback data (projects/sessions lists)
-_callback_data: dict[str, dict] = {}
+_callback_data: TTLCache[str, dict] = TTLCache(maxsize=1024, ttl=600)
+
+
+# Session ids are uuid5s of (chat, sequence number) under a namespace drawn
+# once per process: unique without an os.urandom call per new session, and
+# the random namespace keeps them from repeating across restarts
+_SESSION_NAMESPACE = uuid.uuid4()
+_session_seq = itertools.count()
+
+
+def _new_session_id(chat_id: int) -> str:
+    return str(uuid.uuid5(_SESSION_NAMESPACE, f"{chat_id}:{next(_session_seq)}"))
 
 
 def _get_state(chat_id: int, config: Config) -> ChatState:
     if chat_id not in _chat_states:
         _chat_states[chat_id] = ChatState(
-            session_id=str(uuid.uuid4()),
+            session_id=_new_session_id(chat_id),
             working_directory=config.default_working_directory,
         )
     return _chat_states[chat_id]
 
 
-def _is_allowed(user_id: int, config: Config) -> bool:
-    if not config.allowed_user_ids:
-        return True
-    return user_id in config.allowed_user_ids
+# ---- State persistence -------------------------------------------------------
+
+# Seconds between write-backs of chat state; nothing is written if unchanged
+_STATE_FLUSH_INTERVAL = 5
+
+
+def _load_states(path: str) -> None:
+    """Restore the chat states saved by a previous run, if any."""
+    try:
+        with open(path, "rb") as f:
+            saved = orjson.loads(f.read())
+    except FileNotFoundError:
+        return
+    except (OSError, orjson.JSONDecodeError) as e:
+        logger.warning("Could not load chat state from %s: %s", path, e)
+        return
+
+    try:
+        states = {
+            int(chat_id): (
+                ChatState(
+                    session_id=entry["session_id"],
+                    project_dir_name=entry["project_dir_name"],
+                    working_directory=entry["working_directory"],
+                ),
+                bool(entry["created"]),
+            )
+            for chat_id, entry in saved.items()
+        }
+    except (AttributeError, KeyError, TypeError, ValueError) as e:
+        # Valid JSON but not something we wrote: start fresh, like a missing file
+        logger.warning("Ignoring malformed chat state in %s: %r", path, e)
+        return
+
+    for chat_id, (state, created) in states.items():
+        _chat_states[chat_id] = state
+        if created:
+            claude_executor.mark_session_created(state.session_id)
+    logger.info("Restored state for %d chats from %s", len(saved), path)
+
+
+def _snapshot_states() -> bytes:
+    states = {}
+    for chat_id in _chat_states:
+        # Cache.__getitem__ reads without refreshing the entry's LRU position
+        state = Cache.__getitem__(_chat_states, chat_id)
+        states[str(chat_id)] = {
+            "session_id": state.session_id,
+            "project_dir_name": state.project_dir_name,
+            "working_directory": state.working_directory,
+            "created": claude_executor.is_session_created(state.session_id),
+        }
+    return orjson.dumps(states)
+
+
+def _write_states(path: str, data: bytes) -> None:
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+async def _flush_states_loop(path: str) -> None:
+    last = None
+    while True:
+        await asyncio.sleep(_STATE_FLUSH_INTERVAL)
+        snapshot = _snapshot_states()
+        if snapshot == last:
+            continue
+        write = asyncio.ensure_future(asyncio.to_thread(_write_states, path, snapshot))
+        try:
+            await asyncio.shield(write)
+        except asyncio.CancelledError:
+            # Cancelling can't stop the thread, so let its write land before
+            # the final flush writes the same file
+            await asyncio.wait([write])
+            raise
+        except OSError as e:
+            logger.warning("Could not save chat state to %s: %s", path, e)
+        else:
+            last = snapshot
+
+
+async def _start_state_flush(app: Application) -> None:
+    config: Config = app.bot_data["config"]
+    app.bot_data["state_flush"] = asyncio.create_task(_flush_states_loop(config.state_file))
+
+
+async def _stop_state_flush(app: Application) -> None:
+    task = app.bot_data["state_flush"]
+    task.cancel()
+    with suppress(asyncio.CancelledError):
+        await task
+    config: Config = app.bot_data["config"]
+    try:
+        _write_states(config.state_file, _snapshot_states())
+    except OSError as e:
+        logger.warning("Could not save chat state to %s: %s", config.state_file, e)
+
+
+def _short_id() -> str:
+    """8 hex chars identifying a batch of buttons in callback data."""
+    return secrets.token_hex(4)
 
 
 def _format_denials(denials: list[PermissionDenial]) -> str:
@@ -76,14 +211,6 @@ def _format_denials(denials: list[PermissionDenial]) -> str:
     return "\n".join(lines)
 
 
-def _short_path(path: str) -> str:
-    """Shorten a path for button labels: /Users/foo/Desktop/myproject -> ~/Desktop/myproject"""
-    home = os.path.expanduser("~")
-    if path.startswith(home):
-        return "~" + path[len(home):]
-    return path
-
-
 # ---- Onboarding & project/session buttons -----------------------------------
 
 async def _send_onboarding(chat_id: int, config: Config, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -102,7 +229,9 @@ async def _send_onboarding(chat_id: int, config: Config, context: ContextTypes.D
 
 async def _send_project_buttons(chat_id: int, config: Config, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Send inline keyboard with project buttons."""
-    projects = list_projects(config.claude_projects_dir)
+    # Here and below, sessions.py calls can hit the disk, so they run in a
+    # worker thread rather than stalling every other chat
+    projects = await asyncio.to_thread(list_projects, config.claude_projects_dir)
     if not projects:
         await context.bot.send_message(
             chat_id=chat_id,
@@ -111,13 +240,13 @@ async def _send_project_buttons(chat_id: int, config: Config, context: ContextTy
         return
 
     # Store projects for callback resolution
-    cb_id = str(uuid.uuid4())[:8]
+    cb_id = _short_id()
     _callback_data[cb_id] = {"type": "projects", "projects": projects}
 
     # Build button grid (1 project per row, max 8)
     buttons = []
     for i, p in enumerate(projects[:8]):
-        label = _short_path(p.real_path)
+        label = p.short_path
         buttons.append([InlineKeyboardButton(
             f"{label}  ({p.session_count} sessions)",
             callback_data=f"proj:{cb_id}:{i}",
@@ -141,9 +270,10 @@ async def _send_session_buttons(
     working_directory: str, context: ContextTypes.DEFAULT_TYPE,
 ) -> None:
     """Send inline keyboard with session buttons for a project."""
-    sessions = list_sessions(config.claude_projects_dir, project_dir_name)
+    sessions = await asyncio.to_thread(list_sessions, config.claude_projects_dir, project_dir_name)
+    _get_state(chat_id, config).recent_sessions = sessions
 
-    cb_id = str(uuid.uuid4())[:8]
+    cb_id = _short_id()
     _callback_data[cb_id] = {"type": "sessions", "sessions": sessions}
 
     buttons = []
@@ -167,7 +297,7 @@ async def _send_session_buttons(
 
     await context.bot.send_message(
         chat_id=chat_id,
-        text=f"Project: {_short_path(working_directory)}\n\nResume a session or start new:",
+        text=f"Project: {short_path(working_directory)}\n\nResume a session or start new:",
         reply_markup=InlineKeyboardMarkup(buttons),
     )
 
@@ -182,11 +312,12 @@ async def handle_project_callback(update: Update, context: ContextTypes.DEFAULT_
     config: Config = context.bot_data["config"]
     chat_id = query.message.chat_id
 
-    parts = query.data.split(":")
-    if len(parts) != 3:
+    # proj:<cb_id>:<selection>
+    _, _, rest = query.data.partition(":")
+    cb_id, sep, selection = rest.partition(":")
+    if not sep:
         return
 
-    _, cb_id, selection = parts
     cb_data = _callback_data.pop(cb_id, None)
     if not cb_data or cb_data["type"] != "projects":
         await query.edit_message_text("This selection has expired. Use /projects.")
@@ -198,12 +329,14 @@ async def handle_project_callback(update: Update, context: ContextTypes.DEFAULT_
     if selection == "more":
         # Show all projects as text list
         _callback_data[cb_id] = cb_data  # re-store
-        lines = ["All projects:\n"]
-        for i, p in enumerate(projects, 1):
-            lines.append(f"{i}. {_short_path(p.real_path)}  ({p.session_count} sessions)")
-        lines.append("\nUse /cd <number> to switch.")
+        listing = "\n".join(
+            f"{i}. {p.short_path}  ({p.session_count} sessions)"
+            for i, p in enumerate(projects, 1)
+        )
         context.chat_data["project_list"] = projects
-        await query.edit_message_text("\n".join(lines))
+        await query.edit_message_text(
+            f"All projects:\n\n{listing}\n\nUse /cd <number> to switch."
+        )
         return
 
     try:
@@ -215,9 +348,9 @@ async def handle_project_callback(update: Update, context: ContextTypes.DEFAULT_
         p = projects[idx]
         state.project_dir_name = p.dir_name
         state.working_directory = p.real_path
-        state.session_id = str(uuid.uuid4())
+        state.session_id = _new_session_id(chat_id)
 
-        await query.edit_message_text(f"Selected: {_short_path(p.real_path)}")
+        await query.edit_message_text(f"Selected: {p.short_path}")
 
         # Now show sessions for this project
         await _send_session_buttons(chat_id, config, p.dir_name, p.real_path, context)
@@ -231,11 +364,12 @@ async def handle_session_callback(update: Update, context: ContextTypes.DEFAULT_
     config: Config = context.bot_data["config"]
     chat_id = query.message.chat_id
 
-    parts = query.data.split(":")
-    if len(parts) != 3:
+    # sess:<cb_id>:<selection>
+    _, _, rest = query.data.partition(":")
+    cb_id, sep, selection = rest.partition(":")
+    if not sep:
         return
 
-    _, cb_id, selection = parts
     cb_data = _callback_data.pop(cb_id, None)
     if not cb_data or cb_data["type"] != "sessions":
         await query.edit_message_text("This selection has expired. Use /sessions.")
@@ -245,8 +379,8 @@ async def handle_session_callback(update: Update, context: ContextTypes.DEFAULT_
     state = _get_state(chat_id, config)
 
     if selection == "new":
-        state.session_id = str(uuid.uuid4())
-        claude_executor._created_sessions.discard(state.session_id)
+        state.session_id = _new_session_id(chat_id)
+        claude_executor.unmark_session_created(state.session_id)
         await query.edit_message_text(
             "New conversation started.\n\n"
             "Send a message to chat with Claude."
@@ -261,7 +395,7 @@ async def handle_session_callback(update: Update, context: ContextTypes.DEFAULT_
     if 0 <= idx < len(sessions):
         s = sessions[idx]
         state.session_id = s.session_id
-        claude_executor._created_sessions.add(s.session_id)
+        claude_executor.mark_session_created(s.session_id)
         if s.cwd:
             state.working_directory = s.cwd
 
@@ -274,29 +408,31 @@ async def handle_session_callback(update: Update, context: ContextTypes.DEFAULT_
 
 # ---- Command handlers -------------------------------------------------------
 
-async def cmd_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    config: Config = context.bot_data["config"]
-    if not _is_allowed(update.effective_user.id, config):
-        await update.message.reply_text("You are not authorized to use this bot.")
-        return
+def _with_config(handler):
+    """Call a command handler with the shared Config as a third argument.
+
+    Authorization already happened in the handler's filter, so this is the
+    only per-update setup commands need.
+    """
+    @functools.wraps(handler)
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        await handler(update, context, context.bot_data["config"])
+    return wrapper
+
 
+@_with_config
+async def cmd_start(update: Update, context: ContextTypes.DEFAULT_TYPE, config: Config) -> None:
     chat_id = update.effective_chat.id
     await _send_onboarding(chat_id, config, context)
 
 
-async def cmd_projects(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    config: Config = context.bot_data["config"]
-    if not _is_allowed(update.effective_user.id, config):
-        return
-
+@_with_config
+async def cmd_projects(update: Update, context: ContextTypes.DEFAULT_TYPE, config: Config) -> None:
     await _send_project_buttons(update.effective_chat.id, config, context)
 
 
-async def cmd_cd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    config: Config = context.bot_data["config"]
-    if not _is_allowed(update.effective_user.id, config):
-        return
-
+@_with_config
+async def cmd_cd(update: Update, context: ContextTypes.DEFAULT_TYPE, config: Config) -> None:
     if not context.args:
         state = _get_state(update.effective_chat.id, config)
         cwd = state.working_directory or "not set"
@@ -305,19 +441,20 @@ async def cmd_cd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         return
 
     arg = " ".join(context.args)
-    projects = list_projects(config.claude_projects_dir)
 
     # Try as a number
     try:
         idx = int(arg) - 1
-        project_list = context.chat_data.get("project_list", projects)
+        project_list = context.chat_data.get("project_list")
+        if project_list is None:
+            project_list = await asyncio.to_thread(list_projects, config.claude_projects_dir)
         if 0 <= idx < len(project_list):
             p = project_list[idx]
             state = _get_state(update.effective_chat.id, config)
             state.project_dir_name = p.dir_name
             state.working_directory = p.real_path
-            state.session_id = str(uuid.uuid4())
-            await update.message.reply_text(f"Switched to: {_short_path(p.real_path)}")
+            state.session_id = _new_session_id(update.effective_chat.id)
+            await update.message.reply_text(f"Switched to: {p.short_path}")
             await _send_session_buttons(
                 update.effective_chat.id, config, p.dir_name, p.real_path, context
             )
@@ -328,27 +465,28 @@ async def cmd_cd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     except ValueError:
         pass
 
-    # Try as a path match
-    for p in projects:
-        if arg in p.real_path or arg in p.dir_name:
-            state = _get_state(update.effective_chat.id, config)
-            state.project_dir_name = p.dir_name
-            state.working_directory = p.real_path
-            state.session_id = str(uuid.uuid4())
-            await update.message.reply_text(f"Switched to: {_short_path(p.real_path)}")
-            await _send_session_buttons(
-                update.effective_chat.id, config, p.dir_name, p.real_path, context
-            )
-            return
+    # Try as an exact path or dir name, then as a substring of one
+    index = await asyncio.to_thread(build_project_index, config.claude_projects_dir)
+    p = index.get(arg)
+    if p is None:
+        projects = await asyncio.to_thread(list_projects, config.claude_projects_dir)
+        p = next((p for p in projects if arg in p.real_path or arg in p.dir_name), None)
+    if p is not None:
+        state = _get_state(update.effective_chat.id, config)
+        state.project_dir_name = p.dir_name
+        state.working_directory = p.real_path
+        state.session_id = _new_session_id(update.effective_chat.id)
+        await update.message.reply_text(f"Switched to: {p.short_path}")
+        await _send_session_buttons(
+            update.effective_chat.id, config, p.dir_name, p.real_path, context
+        )
+        return
 
     await update.message.reply_text(f"Project not found: {arg}")
 
 
-async def cmd_sessions(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    config: Config = context.bot_data["config"]
-    if not _is_allowed(update.effective_user.id, config):
-        return
-
+@_with_config
+async def cmd_sessions(update: Update, context: ContextTypes.DEFAULT_TYPE, config: Config) -> None:
     state = _get_state(update.effective_chat.id, config)
 
     if not state.project_dir_name:
@@ -362,11 +500,8 @@ async def cmd_sessions(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     )
 
 
-async def cmd_resume(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    config: Config = context.bot_data["config"]
-    if not _is_allowed(update.effective_user.id, config):
-        return
-
+@_with_config
+async def cmd_resume(update: Update, context: ContextTypes.DEFAULT_TYPE, config: Config) -> None:
     if not context.args:
         # No args: show session buttons if project is selected
         state = _get_state(update.effective_chat.id, config)
@@ -391,13 +526,13 @@ async def cmd_resume(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
         if 0 <= idx < len(session_list):
             s = session_list[idx]
             state.session_id = s.session_id
-            claude_executor._created_sessions.add(s.session_id)
+            claude_executor.mark_session_created(s.session_id)
             if s.cwd:
                 state.working_directory = s.cwd
             await update.message.reply_text(
                 f"Resumed: \"{s.first_message[:60]}\"\n"
                 f"Session: {s.session_id[:8]}...\n"
-                f"Working dir: {_short_path(state.working_directory)}"
+                f"Working dir: {short_path(state.working_directory)}"
             )
             return
     except ValueError:
@@ -405,23 +540,28 @@ async def cmd_resume(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
 
     # Try as session ID (full or prefix)
     session_id = arg
-    if len(session_id) < 36 and state.project_dir_name:
-        sessions = list_sessions(config.claude_projects_dir, state.project_dir_name, limit=50)
-        for s in sessions:
-            if s.session_id.startswith(session_id):
-                session_id = s.session_id
-                break
-
-    found = find_session(config.claude_projects_dir, session_id)
+    if len(session_id) < 36:
+        match = next(
+            (s for s in state.recent_sessions if s.session_id.startswith(session_id)), None
+        )
+        if match is None and state.project_dir_name:
+            sessions = await asyncio.to_thread(
+                list_sessions, config.claude_projects_dir, state.project_dir_name, limit=50
+            )
+            match = next((s for s in sessions if s.session_id.startswith(session_id)), None)
+        if match is not None:
+            session_id = match.session_id
+
+    found = await asyncio.to_thread(find_session, config.claude_projects_dir, session_id)
     if found:
         project_dir_name, cwd = found
         state.session_id = session_id
         state.project_dir_name = project_dir_name
         state.working_directory = cwd
-        claude_executor._created_sessions.add(session_id)
+        claude_executor.mark_session_created(session_id)
         await update.message.reply_text(
             f"Resumed session: {session_id[:8]}...\n"
-            f"Working dir: {_short_path(cwd)}"
+            f"Working dir: {short_path(cwd)}"
         )
     else:
         await update.message.reply_text(f"Session not found: {session_id}")
@@ -429,10 +569,6 @@ async def cmd_resume(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
 
 async def cmd_resume_shortcut(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle /resume_<short_id> shortcuts."""
-    config: Config = context.bot_data["config"]
-    if not _is_allowed(update.effective_user.id, config):
-        return
-
     cmd_text = update.message.text
     prefix = cmd_text.split("_", 1)[1] if "_" in cmd_text else ""
     if not prefix:
@@ -442,23 +578,17 @@ async def cmd_resume_shortcut(update: Update, context: ContextTypes.DEFAULT_TYPE
     await cmd_resume(update, context)
 
 
-async def cmd_new(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    config: Config = context.bot_data["config"]
-    if not _is_allowed(update.effective_user.id, config):
-        return
-
+@_with_config
+async def cmd_new(update: Update, context: ContextTypes.DEFAULT_TYPE, config: Config) -> None:
     state = _get_state(update.effective_chat.id, config)
     old_id = state.session_id
-    claude_executor._created_sessions.discard(old_id)
-    state.session_id = str(uuid.uuid4())
+    claude_executor.unmark_session_created(old_id)
+    state.session_id = _new_session_id(update.effective_chat.id)
     await update.message.reply_text("Conversation reset. Starting fresh!")
 
 
-async def cmd_model(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    config: Config = context.bot_data["config"]
-    if not _is_allowed(update.effective_user.id, config):
-        return
-
+@_with_config
+async def cmd_model(update: Update, context: ContextTypes.DEFAULT_TYPE, config: Config) -> None:
     if not context.args:
         await update.message.reply_text(
             f"Current model: {config.claude_model}\n"
@@ -470,11 +600,8 @@ async def cmd_model(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     await update.message.reply_text(f"Model set to: {config.claude_model}")
 
 
-async def cmd_budget(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    config: Config = context.bot_data["config"]
-    if not _is_allowed(update.effective_user.id, config):
-        return
-
+@_with_config
+async def cmd_budget(update: Update, context: ContextTypes.DEFAULT_TYPE, config: Config) -> None:
     if not context.args:
         current = config.claude_max_budget or "not set"
         await update.message.reply_text(
@@ -487,13 +614,10 @@ async def cmd_budget(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
     await update.message.reply_text(f"Budget cap set to: ${config.claude_max_budget}")
 
 
-async def cmd_status(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    config: Config = context.bot_data["config"]
-    if not _is_allowed(update.effective_user.id, config):
-        return
-
+@_with_config
+async def cmd_status(update: Update, context: ContextTypes.DEFAULT_TYPE, config: Config) -> None:
     state = _get_state(update.effective_chat.id, config)
-    cwd = _short_path(state.working_directory) if state.working_directory else "not set"
+    cwd = short_path(state.working_directory) if state.working_directory else "not set"
     sid = state.session_id[:8] + "..."
 
     lines = [
@@ -525,7 +649,7 @@ async def handle_nav_callback(update: Update, context: ContextTypes.DEFAULT_TYPE
     config: Config = context.bot_data["config"]
     chat_id = query.message.chat_id
 
-    action = query.data.split(":")[1]
+    action = query.data[4:]  # after "nav:"
 
     if action == "projects":
         await query.edit_message_text("Select a project:")
@@ -544,61 +668,170 @@ async def handle_nav_callback(update: Update, context: ContextTypes.DEFAULT_TYPE
 
     elif action == "new":
         state = _get_state(chat_id, config)
-        claude_executor._created_sessions.discard(state.session_id)
-        state.session_id = str(uuid.uuid4())
+        claude_executor.unmark_session_created(state.session_id)
+        state.session_id = _new_session_id(chat_id)
         await query.edit_message_text("New conversation started. Send a message!")
 
 
 # ---- Message handler ---------------------------------------------------------
 
+# Characters MarkdownV2 needs escaped; chunks without any go out as plain text
+_MD_META = re.compile(r"[_*\[\]()~`>#+\-=|{}.!\\]")
+
+# A whole chunk that is one fenced block: ```lang\n<body>\n```
+_FENCED = re.compile(r"```(\w*)\n(.*?)\n?```", re.DOTALL)
+
+
+def _code_block(chunk: str) -> str | None:
+    """MarkdownV2 for a chunk that is entirely code, or None if it isn't.
+
+    Inside a pre block only backslashes and backticks need escaping, which
+    is far less work than escaping every metacharacter.
+    """
+    if chunk.startswith("```"):
+        match = _FENCED.fullmatch(chunk)
+        if match is None or "```" in match[2]:
+            return None
+        lang, body = match.groups()
+    elif chunk.count("\n") >= 3 and all(
+        line.startswith("    ") for line in chunk.splitlines() if line.strip()
+    ):
+        lang, body = "", chunk
+    else:
+        return None
+    body = body.replace("\\", "\\\\").replace("`", "\\`")
+    return f"```{lang}\n{body}\n```"
+
+
+# Telegram allows about one message per second in a chat; consecutive chunks
+# are spaced slightly wider than that so bursts don't draw 429s
+_CHAT_SEND_INTERVAL = 1.05
+
+# Per-chat outbox drained by a single writer task, so chunks from overlapping
+# turns never interleave: chat_id -> (queue, writer task)
+_send_queues: dict[int, tuple[asyncio.Queue, asyncio.Task]] = {}
+
+
+def _outbox(bot, chat_id: int) -> asyncio.Queue:
+    entry = _send_queues.get(chat_id)
+    if entry is None:
+        queue: asyncio.Queue = asyncio.Queue()
+        entry = _send_queues[chat_id] = (queue, asyncio.create_task(_chat_writer(bot, chat_id, queue)))
+    return entry[0]
+
+
+async def _chat_writer(bot, chat_id: int, queue: asyncio.Queue) -> None:
+    """Send queued (escaped, plain, done) chunks in order until the queue is empty.
+
+    escaped is None for chunks that need no MarkdownV2 escaping. Sends are
+    spaced to stay under Telegram's per-chat rate limit.
+    """
+    loop = asyncio.get_running_loop()
+    next_send = 0.0
+    done = None
+    try:
+        while not queue.empty():
+            escaped, plain, done = queue.get_nowait()
+            if done.done():
+                # The caller stopped waiting (cancelled); don't send it
+                continue
+            delay = next_send - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            next_send = loop.time() + _CHAT_SEND_INTERVAL
+            try:
+                if escaped is None:
+                    await bot.send_message(chat_id=chat_id, text=plain)
+                else:
+                    try:
+                        await bot.send_message(
+                            chat_id=chat_id, text=escaped, parse_mode=ParseMode.MARKDOWN_V2
+                        )
+                    except BadRequest:
+                        # Telegram couldn't parse it; other failures propagate
+                        await bot.send_message(chat_id=chat_id, text=plain)
+            except Exception as e:
+                if not done.done():
+                    done.set_exception(e)
+            else:
+                if not done.done():
+                    done.set_result(None)
+    finally:
+        # No await since the last empty() check, so nothing can have been queued
+        del _send_queues[chat_id]
+        # If the writer itself was cancelled, nothing left will be sent; fail
+        # those chunks rather than leave their callers waiting forever
+        if done is not None:
+            done.cancel()
+        while not queue.empty():
+            queue.get_nowait()[2].cancel()
+
+
 async def _send_response(chat_id: int, text: str, context: ContextTypes.DEFAULT_TYPE) -> None:
     if not text:
         text = "[No response from Claude]"
 
     chunks = split_message(text)
-    for chunk in chunks:
-        try:
-            escaped = escape_markdown_v2(chunk)
-            await context.bot.send_message(
-                chat_id=chat_id, text=escaped, parse_mode=ParseMode.MARKDOWN_V2
-            )
-        except Exception:
-            await context.bot.send_message(chat_id=chat_id, text=chunk)
+    escaped = [
+        _code_block(chunk)
+        or (escape_markdown_v2(chunk) if _MD_META.search(chunk) else None)
+        for chunk in chunks
+    ]
 
+    loop = asyncio.get_running_loop()
+    done = [loop.create_future() for _ in chunks]
+    queue = _outbox(context.bot, chat_id)
+    for item in zip(escaped, chunks, done):
+        queue.put_nowait(item)
 
-async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    config: Config = context.bot_data["config"]
-    user_id = update.effective_user.id
+    # Wait for every chunk so no failure goes unretrieved, then raise the first
+    results = await asyncio.gather(*done, return_exceptions=True)
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
 
-    if not _is_allowed(user_id, config):
-        await update.message.reply_text("You are not authorized to use this bot.")
-        return
 
+async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     prompt = update.message.text
     if not prompt:
         return
 
+    config: Config = context.bot_data["config"]
     chat_id = update.effective_chat.id
     state = _get_state(chat_id, config)
 
+    if await _forward_to_claude(update, context, config, state, chat_id, prompt):
+        return
+
     # No project selected: show onboarding
+    await _send_onboarding(chat_id, config, context)
+
+
+async def _forward_to_claude(
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
+    config: Config,
+    state: ChatState,
+    chat_id: int,
+    prompt: str,
+) -> bool:
+    """The common case of handle_message: run the prompt and send the reply.
+
+    Returns False, without doing anything, if the chat has no project yet.
+    """
     if not state.project_dir_name:
-        await _send_onboarding(chat_id, config, context)
-        return
+        return False
 
     cwd = state.working_directory or config.default_working_directory
 
-    logger.info("User %s (chat %s) sent: %s", user_id, chat_id, prompt[:80])
-
-    await context.bot.send_chat_action(chat_id=chat_id, action=ChatAction.TYPING)
+    logger.info(
+        "User %s (chat %s) sent: %s", update.effective_user.id, chat_id, prompt[:80]
+    )
 
-    typing_task = asyncio.ensure_future(_keep_typing(context.bot, chat_id))
-    try:
+    async with _typing(context.bot, chat_id):
         result = await claude_executor.execute(
             prompt, state.session_id, config, working_directory=cwd
         )
-    finally:
-        typing_task.cancel()
 
     if result.text:
         await _send_response(chat_id, result.text, context)
@@ -612,19 +845,20 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 
     if result.permission_denials:
         await _send_permission_request(
-            chat_id, state.session_id, cwd, result.permission_denials, config, context
+            chat_id, state.session_id, cwd, result.permission_denials, context
         )
 
+    return True
+
 
 async def _send_permission_request(
     chat_id: int,
     session_id: str,
     working_directory: str,
     denials: list[PermissionDenial],
-    config: Config,
     context: ContextTypes.DEFAULT_TYPE,
 ) -> None:
-    callback_id = str(uuid.uuid4())[:8]
+    callback_id = _short_id()
 
     has_bash = any(d.tool_name == "Bash" for d in denials)
     permission_mode = "bypassPermissions" if has_bash else "acceptEdits"
@@ -633,8 +867,6 @@ async def _send_permission_request(
         "chat_id": chat_id,
         "session_id": session_id,
         "working_directory": working_directory,
-        "denials": denials,
-        "config": config,
         "permission_mode": permission_mode,
     }
 
@@ -658,7 +890,7 @@ async def handle_permission_callback(update: Update, context: ContextTypes.DEFAU
     if not data.startswith("perm_"):
         return
 
-    action, callback_id = data.split(":", 1)
+    action, _, callback_id = data.partition(":")
     pending = _pending_permissions.pop(callback_id, None)
 
     if not pending:
@@ -672,13 +904,12 @@ async def handle_permission_callback(update: Update, context: ContextTypes.DEFAU
     chat_id = pending["chat_id"]
     session_id = pending["session_id"]
     working_directory = pending["working_directory"]
-    config = pending["config"]
+    config: Config = context.bot_data["config"]
     permission_mode = pending["permission_mode"]
 
     await query.edit_message_text("Permission granted. Resuming...")
 
-    typing_task = asyncio.ensure_future(_keep_typing(context.bot, chat_id))
-    try:
+    async with _typing(context.bot, chat_id):
         result = await claude_executor.execute(
             "Please proceed with the previously requested operations.",
             session_id,
@@ -686,8 +917,6 @@ async def handle_permission_callback(update: Update, context: ContextTypes.DEFAU
             working_directory=working_directory,
             permission_mode=permission_mode,
         )
-    finally:
-        typing_task.cancel()
 
     if result.text:
         await _send_response(chat_id, result.text, context)
@@ -701,15 +930,61 @@ async def handle_permission_callback(update: Update, context: ContextTypes.DEFAU
     if result.permission_denials:
         await _send_permission_request(
             chat_id, session_id, working_directory,
-            result.permission_denials, config, context,
+            result.permission_denials, context,
         )
 
 
+# Chats with a typing indicator running: chat_id -> (task, number of turns using it)
+_typing_tasks: dict[int, tuple[asyncio.Task, int]] = {}
+
+
+@asynccontextmanager
+async def _typing(bot, chat_id: int):
+    """Show "typing..." in a chat while any turn there is running.
+
+    Overlapping turns in the same chat share one indicator task instead of
+    each sending its own chat actions.
+    """
+    task, users = _typing_tasks.get(chat_id, (None, 0))
+    if task is None:
+        task = asyncio.create_task(_keep_typing(bot, chat_id))
+    _typing_tasks[chat_id] = (task, users + 1)
+    try:
+        yield
+    finally:
+        task, users = _typing_tasks[chat_id]
+        if users == 1:
+            del _typing_tasks[chat_id]
+            task.cancel()
+        else:
+            _typing_tasks[chat_id] = (task, users - 1)
+
+
+# Telegram shows "typing..." for about 5s per chat action
+_TYPING_INTERVAL = 5
+# Failed chat actions are retried at doubling intervals up to this
+_TYPING_MAX_BACKOFF = 60
+
+
 async def _keep_typing(bot, chat_id: int) -> None:
+    delay = _TYPING_INTERVAL
     try:
         while True:
-            await bot.send_chat_action(chat_id=chat_id, action=ChatAction.TYPING)
-            await asyncio.sleep(5)
+            try:
+                await bot.send_chat_action(chat_id=chat_id, action=ChatAction.TYPING)
+            except RetryAfter as e:
+                # Flood control: wait exactly as long as Telegram asks
+                retry_after = e.retry_after
+                if isinstance(retry_after, timedelta):
+                    retry_after = retry_after.total_seconds()
+                await asyncio.sleep(retry_after)
+                continue
+            except TelegramError as e:
+                logger.debug("Chat action failed in chat %s: %s", chat_id, e)
+                delay = min(delay * 2, _TYPING_MAX_BACKOFF)
+            else:
+                delay = _TYPING_INTERVAL
+            await asyncio.sleep(delay)
     except asyncio.CancelledError:
         pass
 
@@ -736,36 +1011,128 @@ async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> N
 
 # ---- Bot setup ---------------------------------------------------------------
 
+# One CommandHandler covers every command; this picks the function
+_COMMAND_TABLE = {
+    "start": cmd_start,
+    "projects": cmd_projects,
+    "cd": cmd_cd,
+    "sessions": cmd_sessions,
+    "resume": cmd_resume,
+    "new": cmd_new,
+    "model": cmd_model,
+    "budget": cmd_budget,
+    "status": cmd_status,
+}
+
+# Button callbacks, routed by callback data prefix from a single handler
+_CB_ROUTES = [
+    (re.compile(r"^proj:"), handle_project_callback),
+    (re.compile(r"^sess:"), handle_session_callback),
+    (re.compile(r"^perm_"), handle_permission_callback),
+    (re.compile(r"^nav:"), handle_nav_callback),
+]
+
+# A session id prefix, up to a full dashed UUID; anchored at both ends so
+# ordinary text is rejected on its first characters
+_RESUME_SHORTCUT = re.compile(r"^/resume_[a-f0-9-]{4,36}$")
+
+
+async def handle_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    # "/cd@MyBot foo" -> "cd"; CommandHandler has already checked it's one of ours
+    command = update.effective_message.text.split(maxsplit=1)[0][1:]
+    await _COMMAND_TABLE[command.partition("@")[0].lower()](update, context)
+
+
+async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    data = update.callback_query.data or ""
+    for pattern, handler in _CB_ROUTES:
+        if pattern.match(data):
+            await handler(update, context)
+            return
+
+
+async def reject_unauthorized(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    await update.message.reply_text("You are not authorized to use this bot.")
+
+
+# Seconds Telegram holds each getUpdates call open waiting for new updates
+_LONG_POLL_TIMEOUT = 30
+
+
 def create_app(config: Config) -> Application:
-    app = Application.builder().token(config.telegram_bot_token).build()
+    # One pooled client for all API calls, so bursts of sends (button lists,
+    # chunked responses) reuse open connections instead of queueing for one.
+    # getUpdates gets its own connection, held open for the long poll.
+    request = HTTPXRequest(
+        connection_pool_size=32,
+        connect_timeout=5.0,
+        read_timeout=30.0,
+        write_timeout=30.0,
+        pool_timeout=10.0,
+    )
+    get_updates_request = HTTPXRequest(
+        connection_pool_size=1,
+        read_timeout=_LONG_POLL_TIMEOUT + 10,
+    )
+
+    # Updates from different chats are handled concurrently; the executor
+    # caps how many claude processes that can put on the machine at once
+    app = (
+        Application.builder()
+        .token(config.telegram_bot_token)
+        .request(request)
+        .get_updates_request(get_updates_request)
+        .concurrent_updates(True)
+        .post_init(_start_state_flush)
+        .post_shutdown(_stop_state_flush)
+        .build()
+    )
     app.bot_data["config"] = config
+    _load_states(config.state_file)
+
+    # Authorization happens once per update in the handler filters, so
+    # handlers themselves never see a disallowed user
+    allowed = (
+        filters.User(user_id=config.allowed_user_ids)
+        if config.allowed_user_ids
+        else filters.ALL
+    )
 
     # Commands
-    app.add_handler(CommandHandler("start", cmd_start))
-    app.add_handler(CommandHandler("projects", cmd_projects))
-    app.add_handler(CommandHandler("cd", cmd_cd))
-    app.add_handler(CommandHandler("sessions", cmd_sessions))
-    app.add_handler(CommandHandler("resume", cmd_resume))
-    app.add_handler(CommandHandler("new", cmd_new))
-    app.add_handler(CommandHandler("model", cmd_model))
-    app.add_handler(CommandHandler("budget", cmd_budget))
-    app.add_handler(CommandHandler("status", cmd_status))
+    app.add_handler(CommandHandler(list(_COMMAND_TABLE), handle_command, filters=allowed))
 
     # Button callbacks
-    app.add_handler(CallbackQueryHandler(handle_project_callback, pattern=r"^proj:"))
-    app.add_handler(CallbackQueryHandler(handle_session_callback, pattern=r"^sess:"))
-    app.add_handler(CallbackQueryHandler(handle_permission_callback, pattern=r"^perm_"))
-    app.add_handler(CallbackQueryHandler(handle_nav_callback, pattern=r"^nav:"))
+    app.add_handler(CallbackQueryHandler(handle_callback))
 
     # /resume_<id> shortcut
     app.add_handler(MessageHandler(
-        filters.Regex(r"^/resume_[a-f0-9]+"), cmd_resume_shortcut
+        filters.Regex(_RESUME_SHORTCUT) & allowed, cmd_resume_shortcut
     ))
 
     # Regular messages
-    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND & allowed, handle_message))
+
+    if config.allowed_user_ids:
+        app.add_handler(MessageHandler(filters.TEXT & ~allowed, reject_unauthorized))
 
     # Global error handler
     app.add_error_handler(error_handler)
 
     return app
+
+
+def run_bot(config: Config) -> None:
+    """Build the app and run it until stopped, via webhook or long polling."""
+    app = create_app(config)
+    if config.webhook_url:
+        # The bot token doubles as a hard-to-guess URL path for the webhook
+        logger.info("Receiving updates via webhook on port %d", config.webhook_port)
+        app.run_webhook(
+            listen="0.0.0.0",
+            port=config.webhook_port,
+            url_path=config.telegram_bot_token,
+            webhook_url=f"{config.webhook_url.rstrip('/')}/{config.telegram_bot_token}",
+            drop_pending_updates=True,
+        )
+    else:
+        app.run_polling(drop_pending_updates=True, timeout=_LONG_POLL_TIMEOUT)
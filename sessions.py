@@ -1,10 +1,47 @@
-import json
+import functools
+import itertools
 import logging
-from dataclasses import dataclass
+import os
+import time
+from collections.abc import Iterator
+from dataclasses import dataclass, field
 from pathlib import Path
 
+import orjson
+
 logger = logging.getLogger(__name__)
 
+# Listings are reused while the directory's mtime is unchanged, but for no
+# longer than this: appending to a session file doesn't touch the directory
+_LISTING_TTL = 5
+
+# projects_dir -> (listed_at, mtime, projects)
+_projects_cache: dict[str, tuple[float, int, list["ProjectInfo"]]] = {}
+# (projects_dir, project_dir_name, limit) -> (listed_at, mtime, sessions)
+_sessions_cache: dict[tuple[str, str, int], tuple[float, int, list["SessionInfo"]]] = {}
+# projects_dir -> (listed_at, mtime, session_id -> (project_dir_name, session file))
+_session_index_cache: dict[str, tuple[float, int, dict[str, tuple[str, Path]]]] = {}
+
+# projects_dir -> (listing the index was built from, index by dir_name and real_path)
+_project_index_cache: dict[str, tuple[list["ProjectInfo"], dict[str, "ProjectInfo"]]] = {}
+
+# _parse_session_file reads this much of a session file up front; the first
+# user message is nearly always within the first few lines
+_SUMMARY_HEAD_BYTES = 16 * 1024
+
+# find_session looks for the session's cwd in at most this many leading lines
+_CWD_SCAN_LINES = 5
+
+_HOME = os.path.expanduser("~")
+_HOME_LEN = len(_HOME)
+
+
+def short_path(path: str) -> str:
+    """Shorten a path for display: /Users/foo/Desktop/myproject -> ~/Desktop/myproject"""
+    if path.startswith(_HOME):
+        return "~" + path[_HOME_LEN:]
+    return path
+
 
 @dataclass
 class ProjectInfo:
@@ -12,6 +49,10 @@ class ProjectInfo:
     dir_name: str       # e.g. "-Users-andreaortu-Desktop-myproject"
     real_path: str      # e.g. "/Users/andreaortu/Desktop/myproject"
     session_count: int
+    short_path: str = field(init=False)  # e.g. "~/Desktop/myproject"
+
+    def __post_init__(self) -> None:
+        self.short_path = short_path(self.real_path)
 
 
 @dataclass
@@ -21,9 +62,11 @@ class SessionInfo:
     cwd: str
     first_message: str
     timestamp: str
-    message_count: int
 
 
+# Each call probes the filesystem once per path component; project
+# directories don't move in practice, so the answer is kept for the process
+@functools.lru_cache(maxsize=4096)
 def _dir_name_to_path(dir_name: str) -> str:
     """Convert a Claude projects dir name back to a real path.
 
@@ -52,43 +95,133 @@ def _dir_name_to_path(dir_name: str) -> str:
     return best_path
 
 
+def _cached_listing(cache: dict, key, path: str, build, empty, ttl: float | None = _LISTING_TTL):
+    """build(), reused while path's mtime is unchanged and, if ttl is set,
+    for at most ttl seconds. empty is returned when path can't be stat'ed.
+    """
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return empty
+    now = time.monotonic()
+    cached = cache.get(key)
+    if cached and cached[1] == mtime and (ttl is None or now - cached[0] < ttl):
+        return cached[2]
+    result = build()
+    cache[key] = (now, mtime, result)
+    return result
+
+
 def list_projects(projects_dir: str) -> list[ProjectInfo]:
     """List all Claude Code projects."""
-    projects_path = Path(projects_dir)
-    if not projects_path.is_dir():
+    return _cached_listing(
+        _projects_cache, projects_dir, projects_dir,
+        lambda: _scan_projects(projects_dir),
+        [],
+    )
+
+
+def _subdirs(path: str) -> list[os.DirEntry]:
+    """Directories directly under path, sorted by name ([] if path is missing).
+
+    DirEntry.is_dir() answers from the directory listing itself, so unlike
+    Path.iterdir() + is_dir() this costs no stat per entry.
+    """
+    try:
+        with os.scandir(path) as it:
+            return sorted((e for e in it if e.is_dir()), key=lambda e: e.name)
+    except OSError:
+        return []
+
+
+def _session_entries(project_path: str) -> list[os.DirEntry]:
+    """The *.jsonl entries directly under a project directory."""
+    try:
+        with os.scandir(project_path) as it:
+            return [e for e in it if e.name.endswith(".jsonl")]
+    except OSError:
         return []
 
+
+def _count_sessions(project_path: str) -> int:
+    """Like len(_session_entries(...)), without keeping the entries around."""
+    try:
+        with os.scandir(project_path) as it:
+            return sum(1 for e in it if e.name.endswith(".jsonl"))
+    except OSError:
+        return 0
+
+
+def _scan_projects(projects_dir: str) -> list[ProjectInfo]:
     projects = []
-    for entry in sorted(projects_path.iterdir()):
-        if not entry.is_dir():
-            continue
-        session_files = list(entry.glob("*.jsonl"))
-        if not session_files:
+    for entry in _subdirs(projects_dir):
+        session_count = _count_sessions(entry.path)
+        if not session_count:
             continue
         projects.append(ProjectInfo(
             dir_name=entry.name,
             real_path=_dir_name_to_path(entry.name),
-            session_count=len(session_files),
+            session_count=session_count,
         ))
 
     return projects
 
 
+def build_project_index(projects_dir: str) -> dict[str, ProjectInfo]:
+    """Map each project's dir_name and real_path to the project.
+
+    Rebuilt only when list_projects returns a fresh listing.
+    """
+    projects = list_projects(projects_dir)
+    cached = _project_index_cache.get(projects_dir)
+    if cached and cached[0] is projects:
+        return cached[1]
+    index = {p.dir_name: p for p in projects} | {p.real_path: p for p in projects}
+    _project_index_cache[projects_dir] = (projects, index)
+    return index
+
+
+def build_session_index(projects_dir: str) -> dict[str, tuple[str, Path]]:
+    """Map every session id to its (project_dir_name, session file)."""
+    return _cached_listing(
+        _session_index_cache, projects_dir, projects_dir,
+        lambda: _scan_session_index(projects_dir),
+        {},
+        # Kept until a project is added or removed. New sessions don't show
+        # up in it; find_session probes for those and adds them itself.
+        ttl=None,
+    )
+
+
+def _scan_session_index(projects_dir: str) -> dict[str, tuple[str, Path]]:
+    index = {}
+    for project in list_projects(projects_dir):
+        for entry in _session_entries(os.path.join(projects_dir, project.dir_name)):
+            index[entry.name.removesuffix(".jsonl")] = (project.dir_name, Path(entry.path))
+    return index
+
+
 def list_sessions(projects_dir: str, project_dir_name: str, limit: int = 10) -> list[SessionInfo]:
     """List recent sessions for a project, sorted by most recent first."""
-    project_path = Path(projects_dir) / project_dir_name
-    if not project_path.is_dir():
-        return []
+    return _cached_listing(
+        _sessions_cache,
+        (projects_dir, project_dir_name, limit),
+        os.path.join(projects_dir, project_dir_name),
+        lambda: _scan_sessions(projects_dir, project_dir_name, limit),
+        [],
+    )
+
 
+def _scan_sessions(projects_dir: str, project_dir_name: str, limit: int) -> list[SessionInfo]:
     session_files = sorted(
-        project_path.glob("*.jsonl"),
-        key=lambda f: f.stat().st_mtime,
+        _session_entries(os.path.join(projects_dir, project_dir_name)),
+        key=lambda e: e.stat().st_mtime,
         reverse=True,
     )[:limit]
 
     sessions = []
     for sf in session_files:
-        info = _parse_session_summary(sf)
+        info = _parse_session_summary(Path(sf.path))
         if info:
             sessions.append(info)
 
@@ -96,39 +229,64 @@ def list_sessions(projects_dir: str, project_dir_name: str, limit: int = 10) ->
 
 
 def _parse_session_summary(session_file: Path) -> SessionInfo | None:
-    """Parse a session JSONL file to extract a summary."""
+    """Parse a session JSONL file to extract a summary.
+
+    Unchanged files (same mtime and size) are never parsed twice.
+    """
+    try:
+        st = session_file.stat()
+    except OSError:
+        return None
+    return _parse_session_file(session_file, st.st_mtime_ns, st.st_size)
+
+
+def _session_lines(f) -> Iterator[bytes]:
+    """Lines of a session file opened in binary mode.
+
+    The head comes from a single bounded read; the first user message is
+    nearly always in it, so the rest of the file is only read if it isn't.
+    """
+    head = f.read(_SUMMARY_HEAD_BYTES)
+    *lines, tail = head.split(b"\n")
+    yield from lines
+    yield tail + f.readline()
+    yield from f
+
+
+@functools.lru_cache(maxsize=1024)
+def _parse_session_file(session_file: Path, mtime_ns: int, size: int) -> SessionInfo | None:
     first_message = ""
     timestamp = ""
     cwd = ""
     session_id = session_file.stem
-    message_count = 0
 
     try:
-        with open(session_file) as f:
-            for line in f:
-                line = line.strip()
-                if not line:
+        # Bytes go straight to orjson, which decodes the UTF-8 itself
+        with open(session_file, "rb") as f:
+            for line in _session_lines(f):
+                if not line or line.isspace():
                     continue
                 try:
-                    data = json.loads(line)
-                except json.JSONDecodeError:
+                    data = orjson.loads(line)
+                except orjson.JSONDecodeError:
                     continue
 
                 if data.get("type") == "user":
-                    message_count += 1
-                    if not first_message:
-                        msg = data.get("message", {})
-                        content = msg.get("content", "")
-                        if isinstance(content, str):
-                            first_message = content[:100]
-                        elif isinstance(content, list):
-                            # Content blocks
-                            for block in content:
-                                if isinstance(block, dict) and block.get("type") == "text":
-                                    first_message = block.get("text", "")[:100]
-                                    break
-                        timestamp = data.get("timestamp", "")
-                        cwd = data.get("cwd", "")
+                    msg = data.get("message", {})
+                    content = msg.get("content", "")
+                    if isinstance(content, str):
+                        first_message = content[:100]
+                    elif isinstance(content, list):
+                        # Content blocks
+                        for block in content:
+                            if isinstance(block, dict) and block.get("type") == "text":
+                                first_message = block.get("text", "")[:100]
+                                break
+                    timestamp = data.get("timestamp", "")
+                    cwd = data.get("cwd", "")
+                    # The summary only needs the first user message
+                    if first_message:
+                        break
     except Exception as e:
         logger.debug("Error parsing session %s: %s", session_file, e)
         return None
@@ -141,7 +299,6 @@ def _parse_session_summary(session_file: Path) -> SessionInfo | None:
         cwd=cwd,
         first_message=first_message,
         timestamp=timestamp,
-        message_count=message_count,
     )
 
 
@@ -150,26 +307,40 @@ def find_session(projects_dir: str, session_id: str) -> tuple[str, str] | None:
 
     Returns (project_dir_name, cwd) or None if not found.
     """
-    projects_path = Path(projects_dir)
-    if not projects_path.is_dir():
+    index = build_session_index(projects_dir)
+    found = index.get(session_id)
+    if found is None:
+        # Sessions created since the index was built aren't in it
+        found = _probe_session(projects_dir, session_id)
+        if found is None:
+            return None
+        index[session_id] = found
+
+    project_dir_name, session_file = found
+    # Extract cwd from the session
+    cwd = _dir_name_to_path(project_dir_name)
+    try:
+        with open(session_file, "rb") as f:
+            # The first user turn, which carries the cwd, is at the very top;
+            # session files can be megabytes, so never read past the head
+            for line in itertools.islice(f, _CWD_SCAN_LINES):
+                data = orjson.loads(line)
+                if data.get("type") == "user" and data.get("cwd"):
+                    cwd = data["cwd"]
+                    break
+    except FileNotFoundError:
+        # Deleted since the index was built
+        index.pop(session_id, None)
         return None
+    except Exception:
+        pass
+    return project_dir_name, cwd
 
-    for entry in projects_path.iterdir():
-        if not entry.is_dir():
-            continue
-        session_file = entry / f"{session_id}.jsonl"
+
+def _probe_session(projects_dir: str, session_id: str) -> tuple[str, Path] | None:
+    for entry in _subdirs(projects_dir):
+        session_file = Path(entry.path, f"{session_id}.jsonl")
         if session_file.exists():
-            # Extract cwd from the session
-            cwd = _dir_name_to_path(entry.name)
-            try:
-                with open(session_file) as f:
-                    for line in f:
-                        data = json.loads(line.strip())
-                        if data.get("type") == "user" and data.get("cwd"):
-                            cwd = data["cwd"]
-                            break
-            except Exception:
-                pass
-            return entry.name, cwd
+            return entry.name, session_file
 
     return None